@@ -1,19 +1,130 @@
 import streamlit as st
 import requests
-import os
-import tempfile
+from requests.adapters import HTTPAdapter
+import io
+import json
 from PIL import Image
 
 # FastAPI endpoint
 API_URL = "http://localhost:8000"
 
+# Finished searches kept per browser session so repeated queries render instantly
+SEARCH_CACHE_SIZE = 64
+
+def stream_events(response):
+    """Yield (event, payload) pairs from a server-sent events response"""
+    event = "message"
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            yield event, json.loads(line[len("data: "):])
+        elif not line:
+            event = "message"
+
+class SearchError(Exception):
+    """Raised when the backend reports a failed search"""
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _thumb(image_bytes, name):
+    """Decode an uploaded image into a small thumbnail (cached across reruns)"""
+    img = Image.open(io.BytesIO(image_bytes))
+    img.thumbnail((300, 300))
+    return img
+
+def stream_search(query: str):
+    """Yield matches for a query as the server streams them"""
+    # Closing the response returns its connection to the pooled session
+    with st.session_state.http.post(
+        f"{API_URL}/query_images/",
+        json={"query": query},
+        stream=True
+    ) as response:
+        if response.status_code != 200:
+            raise SearchError(response.text)
+        
+        for event, payload in stream_events(response):
+            if event == "error":
+                raise SearchError(payload["detail"])
+            yield payload
+
+def cache_search(query: str, results: list):
+    """Remember finished results for a query, evicting the oldest beyond the limit"""
+    cache = st.session_state.search_cache
+    cache.pop(query, None)
+    cache[query] = results
+    while len(cache) > SEARCH_CACHE_SIZE:
+        cache.pop(next(iter(cache)))
+
+def prefetch(queries):
+    """Fetch API status and warm the given queries in a single batched call"""
+    batch = [{"url": "/status/"}] + [
+        {"url": "/query_images/", "json": {"query": q}} for q in queries
+    ]
+    response = st.session_state.http.post(f"{API_URL}/batch/", json={"requests": batch})
+    response.raise_for_status()
+    
+    status = None
+    results = {}
+    for item in response.json()["responses"]:
+        if item["status_code"] != 200:
+            continue
+        if item["url"] == "/status/":
+            status = item["body"]
+        else:
+            results[item["body"]["query"]] = item["body"]["results"]
+    return status, results
+
+def render_result(i, result):
+    """Display a single search match"""
+    st.subheader(f"Match {i+1}")
+    
+    col1, col2 = st.columns([1, 2])
+    
+    with col1:
+        # Display the image
+        image_url = f"{API_URL}{result['image_url']}"
+        try:
+            st.image(image_url, width=300)
+        except Exception as e:
+            st.error(f"Could not load image: {e}")
+            st.write(f"Image URL: {image_url}")
+    
+    with col2:
+        st.write("**Metadata:**")
+        metadata = result["metadata"]
+        
+        # Format metadata nicely
+        st.write(f"**People:** {metadata.get('number_of_people', 'Unknown')}")
+        st.write(f"**Hand Signs:** {metadata.get('sign_used', 'None')}")
+        st.write(f"**Setting:** {metadata.get('landscape_description', 'Unknown')}")
+        st.write(f"**Weather:** {metadata.get('weather', 'Unknown')}")
+        st.write(f"**Mood:** {metadata.get('mood', 'Unknown')}")
+        st.write(f"**Image:** {metadata.get('image_name', 'Unknown')}")
+        
+        # Show match content
+        with st.expander("View Search Match Details"):
+            st.write("**Content that matched your search:**")
+            st.write(result.get("content", "No content available"))
+    
+    st.divider()
+
 st.title("Text to image-search")
 
 # Initialize session state
 if 'processed' not in st.session_state:
     st.session_state.processed = False
-if 'temp_dir' not in st.session_state:
-    st.session_state.temp_dir = None
+if 'http' not in st.session_state:
+    # Pooled session so reruns reuse keep-alive connections to the API
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    st.session_state.http = session
+if 'search_cache' not in st.session_state:
+    st.session_state.search_cache = {}
+if 'prefetched' not in st.session_state:
+    st.session_state.prefetched = False
+if 'api_status' not in st.session_state:
+    st.session_state.api_status = None
 
 # File upload section
 st.header("Upload Images")
@@ -24,38 +135,34 @@ uploaded_files = st.file_uploader(
 )
 
 if uploaded_files:
-    # Create temp directory if not exists
-    if st.session_state.temp_dir is None:
-        st.session_state.temp_dir = tempfile.mkdtemp()
-    
-    image_paths = []
-    
     # Display uploaded images
     st.subheader("Uploaded Images:")
     cols = st.columns(3)  # Display in 3 columns
     
     for idx, uploaded_file in enumerate(uploaded_files):
-        file_path = os.path.join(st.session_state.temp_dir, uploaded_file.name)
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        image_paths.append(file_path)
-        
         # Show thumbnails in grid
         with cols[idx % 3]:
-            st.image(uploaded_file, caption=uploaded_file.name, width=150)
+            st.image(_thumb(uploaded_file.getvalue(), uploaded_file.name), caption=uploaded_file.name, width=150)
     
     if st.button("Process Images", type="primary"):
         with st.spinner("Processing images with Gemini AI..."):
             try:
-                response = requests.post(
+                # Send the raw bytes as multipart; the API writes each file once
+                response = st.session_state.http.post(
                     f"{API_URL}/process_images/",
-                    json={"image_paths": image_paths}
+                    files=[
+                        ("files", (f.name, f.getvalue(), f.type))
+                        for f in uploaded_files
+                    ]
                 )
                 
                 if response.status_code == 200:
                     result = response.json()
                     st.success(f"Images processed successfully! Processed {result['processed_count']} images.")
                     st.session_state.processed = True
+                    # New images can change any query's results
+                    st.session_state.search_cache = {}
+                    st.session_state.prefetched = False
                     
                     # Show processed metadata
                     with st.expander("View Processed Metadata"):
@@ -84,6 +191,18 @@ if st.session_state.processed:
         "people making peace signs"
     ]
     
+    # Warm every example query (and the status panel) in one round-trip
+    if not st.session_state.prefetched:
+        st.session_state.prefetched = True
+        try:
+            with st.spinner("Preparing example searches..."):
+                st.session_state.api_status, prefetched = prefetch(example_queries)
+            for example, results in prefetched.items():
+                cache_search(example, results)
+        except requests.exceptions.RequestException:
+            # Prefetching is best-effort; searches fall back to individual calls
+            pass
+    
     cols = st.columns(len(example_queries))
     for idx, example in enumerate(example_queries):
         if cols[idx].button(example, key=f"example_{idx}"):
@@ -99,56 +218,30 @@ if st.session_state.processed:
     if query:
         with st.spinner("Searching..."):
             try:
-                response = requests.post(
-                    f"{API_URL}/query_images/",
-                    json={"query": query}
-                )
+                results = st.session_state.search_cache.get(query)
+                summary = st.empty()
                 
-                if response.status_code == 200:
-                    results = response.json()["results"]
+                if results is None:
+                    matches = st.container()
+                    results = []
                     
-                    if not results:
-                        st.warning("No images matched your search. Try different keywords!")
-                    else:
-                        st.success(f"Found {len(results)} matching images")
-                        
-                        # Display results in a nice grid
-                        for i, result in enumerate(results):
-                            st.subheader(f"Match {i+1}")
-                            
-                            col1, col2 = st.columns([1, 2])
-                            
-                            with col1:
-                                # Display the image
-                                image_url = f"{API_URL}{result['image_url']}"
-                                try:
-                                    st.image(image_url, width=300)
-                                except Exception as e:
-                                    st.error(f"Could not load image: {e}")
-                                    st.write(f"Image URL: {image_url}")
-                            
-                            with col2:
-                                st.write("**Metadata:**")
-                                metadata = result["metadata"]
-                                
-                                # Format metadata nicely
-                                st.write(f"**People:** {metadata.get('number_of_people', 'Unknown')}")
-                                st.write(f"**Hand Signs:** {metadata.get('sign_used', 'None')}")
-                                st.write(f"**Setting:** {metadata.get('landscape_description', 'Unknown')}")
-                                st.write(f"**Weather:** {metadata.get('weather', 'Unknown')}")
-                                st.write(f"**Mood:** {metadata.get('mood', 'Unknown')}")
-                                st.write(f"**Image:** {metadata.get('image_name', 'Unknown')}")
-                                
-                                # Show match content
-                                with st.expander("View Search Match Details"):
-                                    st.write("**Content that matched your search:**")
-                                    st.write(result.get("content", "No content available"))
-                            
-                            st.divider()
-                            
+                    # Render each match as soon as the server streams it
+                    for result in stream_search(query):
+                        with matches:
+                            render_result(len(results), result)
+                        results.append(result)
+                    cache_search(query, results)
+                else:
+                    for i, result in enumerate(results):
+                        render_result(i, result)
+                
+                if not results:
+                    summary.warning("No images matched your search. Try different keywords!")
                 else:
-                    st.error(f"Search failed: {response.text}")
+                    summary.success(f"Found {len(results)} matching images")
                     
+            except SearchError as e:
+                st.error(f"Search failed: {e}")
             except requests.exceptions.ConnectionError:
                 st.error("Cannot connect to FastAPI server. Make sure it's running on http://localhost:8000")
             except Exception as e:
@@ -159,14 +252,18 @@ with st.sidebar:
     st.header("System Status")
     if st.button("Check API Status"):
         try:
-            response = requests.get(f"{API_URL}/status/")
+            response = st.session_state.http.get(f"{API_URL}/status/")
             if response.status_code == 200:
                 status = response.json()
+                st.session_state.api_status = status
                 st.success("API is running")
                 st.json(status)
             else:
                 st.error("API not responding properly")
         except:
             st.error("Cannot connect to API")
+    elif st.session_state.api_status:
+        # Last status received with the batched prefetch
+        st.json(st.session_state.api_status)
     
     st.info("Make sure your FastAPI server is running with: `python main.py`")
\ No newline at end of file
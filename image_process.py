@@ -1,8 +1,21 @@
+import asyncio
 import base64
-import json
+import hashlib
+import io
 import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import List, Dict, Any
+import typing_extensions
+import chromadb
+import faiss
+import numpy as np
+import orjson
 import google.generativeai as genai
+from google.api_core.exceptions import ResourceExhausted
 from langchain_community.vectorstores import Chroma
 from langchain.chains.query_constructor.base import AttributeInfo
 from langchain.retrievers.self_query.base import SelfQueryRetriever
@@ -10,74 +23,215 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.documents import Document
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from PIL import Image
-import shutil
-import time
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+# On-disk Chroma store shared across restarts so embeddings are computed once
+CHROMA_PATH = "./chroma_store"
+COLLECTION_NAME = "images"
+
+def _chroma_client():
+    """A shared Chroma server when CHROMA_HOST is set, otherwise the local on-disk store"""
+    host = os.getenv("CHROMA_HOST")
+    if host:
+        # The only setup that is safe to share between API worker processes
+        return chromadb.HttpClient(host=host, port=int(os.getenv("CHROMA_PORT", "8001")))
+    return chromadb.PersistentClient(path=CHROMA_PATH)
+
+# Semantic response cache: queries whose embeddings are this close reuse results
+EMBEDDING_DIM = 768
+QUERY_CACHE_THRESHOLD = 0.95
+QUERY_CACHE_SIZE = 1024
+
+# Below this many documents, flat FAISS search beats Chroma's HNSW index
+FAISS_MAX_DOCS = 10_000
+
+# Query term expansions used by the text search fallback
+SYNONYMS = {
+    'thumbs': ('thumbs up', 'thumb', 'approval', 'positive'),
+    'peace': ('peace sign', 'v sign', 'victory', 'v-sign'),
+    'people': ('person', 'individuals', 'humans', 'group'),
+    'outdoor': ('outside', 'nature', 'exterior'),
+    'indoor': ('inside', 'interior'),
+    'sunny': ('bright', 'clear', 'sunshine'),
+    'happy': ('joyful', 'cheerful', 'positive'),
+    'group': ('multiple', 'several', 'many')
+}
+
+def _lowercase_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of document metadata with string values lowercased for matching"""
+    return {k: (v.lower() if isinstance(v, str) else v) for k, v in metadata.items()}
+
+# Gemini keeps uploaded files for 48 hours; stop reusing handles a bit earlier
+GEMINI_FILE_TTL = 47 * 3600
+
+def _file_sha256(path: str) -> str:
+    """Hash a file's contents without loading it all at once"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Gemini downsamples vision inputs anyway, so larger images only cost upload bytes
+MAX_IMAGE_DIM = 1024
+JPEG_QUALITY = 85
+
+def _load_and_resize(path: str) -> bytes:
+    """Decode an image, shrink it to MAX_IMAGE_DIM and re-encode it as JPEG"""
+    with Image.open(path) as img:
+        img.thumbnail((MAX_IMAGE_DIM, MAX_IMAGE_DIM), Image.LANCZOS)
+        buf = io.BytesIO()
+        img.convert("RGB").save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    return buf.getvalue()
+
+def _document_id(doc: Document) -> str:
+    """Stable id for an image's document, derived from the image bytes"""
+    image_name = doc.metadata["image_name"]
+    try:
+        return _file_sha256(os.path.join("public", image_name))
+    except OSError:
+        # Image is gone from disk; distinct images still never share an id
+        return hashlib.sha256(f"{image_name}\n{doc.page_content}".encode()).hexdigest()
+
+class ImageMetadata(typing_extensions.TypedDict):
+    """Response schema Gemini is constrained to when describing an image"""
+    sign_used: str
+    number_of_people: int
+    landscape_description: str
+    weather: str
+    mood: str
+
+METADATA_PROMPT = """Analyze this image and extract:
+- sign_used: any hand signs visible (V-sign, thumbs-up, peace sign, etc.) or 'none'
+- number_of_people: number of people in the image
+- landscape_description: brief landscape/setting description (indoor/outdoor, beach, mountains, city, etc.)
+- weather: weather condition if visible (sunny, cloudy, rainy, etc.) or 'unknown'
+- mood: overall mood/atmosphere of the image
+
+Be concise and factual."""
 
 class ImageMetadataProcessor:
-    def __init__(self):
+    def __init__(self, max_concurrency: int = 8, max_retries: int = 5):
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
             raise ValueError("GEMINI_API_KEY environment variable is required")
         
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
+        # Have Gemini return schema-conforming JSON straight from the image
+        self.model = genai.GenerativeModel(
+            'gemini-1.5-flash',
+            generation_config={
+                "response_mime_type": "application/json",
+                "response_schema": ImageMetadata
+            }
+        )
         self.metadata_store = []
+        # Cap in-flight Gemini requests to stay within the API's QPS limits
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_retries = max_retries
+        # Upload writes run here so they overlap with in-flight Gemini calls
+        self._io_pool = ThreadPoolExecutor(max_workers=8)
+        # Uploaded Gemini file handles keyed by content hash: (file, upload time)
+        self._file_cache = {}
+        # Uploads currently in progress, keyed by content hash
+        self._pending_uploads = {}
     
-    def save_to_public(self, image_path: str) -> str:
-        """Copy image to public folder and return new path"""
+    def save_to_public(self, filename: str, data: bytes) -> str:
+        """Write image bytes to public folder and return new path"""
         os.makedirs("public", exist_ok=True)
-        filename = os.path.basename(image_path)
+        filename = os.path.basename(filename)
         public_path = os.path.join("public", filename)
         
-        # Handle duplicate filenames
-        counter = 1
-        while os.path.exists(public_path):
+        # Exclusive create, with a random suffix if the filename is already taken
+        try:
+            with open(public_path, "xb") as f:
+                f.write(data)
+        except FileExistsError:
             name, ext = os.path.splitext(filename)
-            public_path = os.path.join("public", f"{name}_{counter}{ext}")
-            counter += 1
+            public_path = os.path.join("public", f"{name}_{uuid.uuid4().hex[:8]}{ext}")
+            with open(public_path, "xb") as f:
+                f.write(data)
         
-        shutil.copy2(image_path, public_path)
         return public_path
     
-    def get_image_description(self, image_path: str) -> str:
-        """Get description of image from Gemini 1.5 Flash"""
+    async def save_upload(self, filename: str, data: bytes) -> str:
+        """Save an uploaded image to the public folder off the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._io_pool, self.save_to_public, filename, data)
+    
+    async def _generate(self, contents):
+        """Call Gemini under the concurrency limit, backing off only when rate limited"""
+        delay = 1.0
+        for attempt in range(self.max_retries):
+            async with self._semaphore:
+                try:
+                    return await self.model.generate_content_async(contents)
+                except ResourceExhausted:
+                    if attempt == self.max_retries - 1:
+                        raise
+            # Sleep outside the semaphore so other requests can proceed
+            print(f"Rate limited by Gemini, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            delay *= 2
+    
+    async def _get_uploaded_file(self, image_path: str):
+        """Upload an image to Gemini, reusing the handle for identical content"""
+        content_hash = await asyncio.to_thread(_file_sha256, image_path)
+        
+        cached = self._file_cache.get(content_hash)
+        if cached is not None:
+            if time.time() - cached[1] < GEMINI_FILE_TTL:
+                return cached[0]
+            # Gemini has deleted (or is about to delete) this upload
+            del self._file_cache[content_hash]
+        
+        # Identical images in flight at the same time share one upload
+        pending = self._pending_uploads.get(content_hash)
+        if pending is None:
+            pending = asyncio.ensure_future(self._upload_file(content_hash, image_path))
+            self._pending_uploads[content_hash] = pending
+            pending.add_done_callback(lambda _: self._pending_uploads.pop(content_hash, None))
+        # Shielded so one cancelled caller does not abort the upload for the others
+        return await asyncio.shield(pending)
+    
+    async def _upload_file(self, content_hash: str, image_path: str):
+        """Upload a file to Gemini and cache its handle"""
+        uploaded_file = await asyncio.to_thread(genai.upload_file, image_path)
+        # Wait a moment for processing
+        await asyncio.sleep(1)
+        
+        # Gemini deletes uploads itself after the TTL, so the handle is kept for reuse
+        now = time.time()
+        self._file_cache = {
+            h: entry for h, entry in self._file_cache.items()
+            if now - entry[1] < GEMINI_FILE_TTL
+        }
+        self._file_cache[content_hash] = (uploaded_file, now)
+        return uploaded_file
+    
+    async def get_image_description(self, image_path: str) -> Dict[str, Any]:
+        """Get structured metadata for an image from Gemini 1.5 Flash in a single call"""
         try:
             print(f"Processing image: {image_path}")
             
             # Try different approaches based on what works with your version
             try:
-                # Method 1: Direct PIL Image approach
-                img = Image.open(image_path)
-                
-                prompt = """Analyze this image and provide:
-1. Number of people in the image
-2. Any hand signs visible (V-sign, thumbs-up, peace sign, etc.) or 'none'
-3. Landscape/setting description (indoor/outdoor, beach, mountains, city, etc.)
-4. Weather condition if visible (sunny, cloudy, rainy, etc.) or 'unknown'
-5. Overall mood/atmosphere of the image
-
-Be concise and factual."""
-
-                response = self.model.generate_content([prompt, img])
-                return response.text
+                # Method 1: Downscaled inline JPEG approach
+                # Decode and resize on a worker thread so the event loop keeps dispatching requests
+                loop = asyncio.get_running_loop()
+                image_bytes = await loop.run_in_executor(None, _load_and_resize, image_path)
+                response = await self._generate([
+                    METADATA_PROMPT,
+                    {"mime_type": "image/jpeg", "data": image_bytes}
+                ])
                 
             except Exception as e1:
                 print(f"Method 1 failed: {e1}")
                 
                 # Method 2: File upload approach
                 try:
-                    uploaded_file = genai.upload_file(image_path)
-                    # Wait a moment for processing
-                    time.sleep(1)
-                    
-                    response = self.model.generate_content([
-                        "Analyze this image and describe: 1) Number of people 2) Hand signs 3) Landscape 4) Weather 5) Mood",
-                        uploaded_file
-                    ])
-                    
-                    # Clean up
-                    genai.delete_file(uploaded_file.name)
-                    return response.text
+                    uploaded_file = await self._get_uploaded_file(image_path)
+                    response = await self._generate([METADATA_PROMPT, uploaded_file])
                     
                 except Exception as e2:
                     print(f"Method 2 failed: {e2}")
@@ -87,244 +241,363 @@ Be concise and factual."""
                         image_data = base64.b64encode(image_file.read()).decode()
                     
                     # This might not work with all versions, but worth trying
-                    response = self.model.generate_content([
-                        "Analyze this image: number of people, hand signs, landscape, weather, mood",
+                    response = await self._generate([
+                        METADATA_PROMPT,
                         {"mime_type": "image/jpeg", "data": image_data}
                     ])
-                    return response.text
             
         except Exception as e:
             print(f"All methods failed for {image_path}: {e}")
             return None
-    
-    def extract_metadata(self, description: str, image_path: str) -> Dict[str, Any]:
-        """Extract structured metadata from description"""
+        
         try:
-            prompt = f"""Based on this image description, extract information as JSON:
-
-Description: {description}
-
-Return ONLY valid JSON in this exact format (no other text):
-{{
-    "sign_used": "describe any hand signs or 'none'",
-    "number_of_people": 0,
-    "landscape_description": "brief setting description",
-    "weather": "weather condition or 'unknown'",
-    "mood": "overall mood/atmosphere"
-}}"""
-            
-            response = self.model.generate_content(prompt)
-            json_str = response.text.strip()
-            
-            # Clean up the response
-            if '```json' in json_str:
-                json_str = json_str.split('```json')[1].split('```')[0].strip()
-            elif '```' in json_str:
-                json_str = json_str.split('```')[1].strip()
-            
-            # Remove any extra text before/after JSON
-            start_idx = json_str.find('{')
-            end_idx = json_str.rfind('}') + 1
-            if start_idx != -1 and end_idx != -1:
-                json_str = json_str[start_idx:end_idx]
-            
-            print(f"Cleaned JSON string: {json_str}")
-            
-            metadata = json.loads(json_str)
-            
-            # Ensure all required fields exist
-            required_fields = ["sign_used", "number_of_people", "landscape_description", "weather", "mood"]
-            for field in required_fields:
-                if field not in metadata:
-                    metadata[field] = "unknown" if field != "number_of_people" else 0
-            
-            metadata['image_name'] = os.path.basename(image_path)
-            return metadata
-            
-        except json.JSONDecodeError as e:
+            # Blocked responses (e.g. finish_reason SAFETY) raise ValueError from .text
+            response_text = response.text
+        except ValueError as e:
+            print(f"No usable response for {image_path}: {e}")
+            return None
+        
+        try:
+            # The model is constrained to the ImageMetadata schema, so no cleanup is needed
+            metadata = orjson.loads(response_text)
+        except orjson.JSONDecodeError as e:
             print(f"JSON decode error: {e}")
-            print(f"Response was: {response.text if 'response' in locals() else 'No response'}")
-            
-            # Fallback: create metadata from description text
-            return self.create_fallback_metadata(description, image_path)
-            
-        except Exception as e:
-            print(f"Error extracting metadata: {e}")
-            return self.create_fallback_metadata(description, image_path)
+            print(f"Response was: {response_text}")
+            return None
+        
+        # Ensure all required fields exist
+        for field in ImageMetadata.__annotations__:
+            if field not in metadata:
+                metadata[field] = "unknown" if field != "number_of_people" else 0
+        
+        metadata['image_name'] = os.path.basename(image_path)
+        return metadata
     
-    def create_fallback_metadata(self, description: str, image_path: str) -> Dict[str, Any]:
-        """Create basic metadata when JSON extraction fails"""
-        # Simple text analysis fallback
-        desc_lower = description.lower()
-        
-        # Count people mentions
-        people_count = 0
-        people_words = ['person', 'people', 'man', 'woman', 'child', 'boy', 'girl']
-        for word in people_words:
-            people_count += desc_lower.count(word)
-        
-        # Detect signs
-        sign_used = "none"
-        if any(sign in desc_lower for sign in ['v-sign', 'peace', 'thumbs up', 'victory']):
-            sign_used = "hand signs detected"
-        
-        # Weather detection
-        weather = "unknown"
-        weather_words = ['sunny', 'cloudy', 'rainy', 'clear', 'overcast', 'bright']
-        for word in weather_words:
-            if word in desc_lower:
-                weather = word
-                break
-        
-        return {
-            "sign_used": sign_used,
-            "number_of_people": min(people_count, 10),  # Cap at reasonable number
-            "landscape_description": description[:100] + "..." if len(description) > 100 else description,
-            "weather": weather,
-            "mood": "neutral",
-            "image_name": os.path.basename(image_path)
-        }
+    async def _process_image(self, path: str) -> Dict[str, Any]:
+        """Extract metadata for a single image"""
+        if not os.path.exists(path):
+            print(f"Image path does not exist: {path}")
+            return None
+            
+        print(f"Processing image: {path}")
+        metadata = await self.get_image_description(path)
+        
+        if metadata:
+            print(f"Successfully processed: {metadata}")
+        else:
+            print(f"Failed to extract metadata for {path}")
+        
+        return metadata
     
-    def process_images(self, image_paths: List[str]) -> List[Dict[str, Any]]:
-        """Process images and return metadata"""
+    async def process_images(self, image_paths: List[str]) -> List[Dict[str, Any]]:
+        """Process images already saved to the public folder concurrently and return metadata"""
         self.metadata_store = []
         
-        for path in image_paths:
-            if not os.path.exists(path):
-                print(f"Image path does not exist: {path}")
-                continue
-                
-            print(f"Processing image: {path}")
-            public_path = self.save_to_public(path)
-            description = self.get_image_description(public_path)
-            
-            if not description:
-                print(f"Failed to get description for {path}")
-                continue
-                
-            print(f"Description: {description}")
-            metadata = self.extract_metadata(description, public_path)
-            
-            if metadata:
-                self.metadata_store.append(metadata)
-                print(f"Successfully processed: {metadata}")
-            else:
-                print(f"Failed to extract metadata for {path}")
-                
-            # Small delay to avoid rate limiting
-            time.sleep(0.5)
+        # Dispatch every image at once; the semaphore in _generate handles rate limiting
+        results = await asyncio.gather(*(self._process_image(path) for path in image_paths))
+        self.metadata_store = [metadata for metadata in results if metadata]
         
         return self.metadata_store
 
 class ImageRetriever:
-    def __init__(self, metadata_store: List[Dict[str, Any]]):
-        self.metadata_store = metadata_store
+    def __init__(self, metadata_store: List[Dict[str, Any]] = None):
+        self.metadata_store = list(metadata_store or [])
         self.vectorstore = None
         self.retriever = None
         self.docs = []
+        # (vectorizer, document matrix), published as one attribute so readers never mix fits
+        self._tfidf = None
+        self.embeddings = None
+        self.doc_ids = []
+        # Lowercased mirrors of each document's content and metadata, built once
+        self._lc = []
+        self._lc_meta = []
+        self.faiss_index = None
+        # Per-instance LRU so repeated queries skip the embedding round-trip
+        self._embed_query = lru_cache(maxsize=1024)(self._embed_query_uncached)
+        # Searches may run concurrently in worker threads (e.g. batched queries)
+        self._qcache_lock = threading.Lock()
+        # Bumped whenever the indexes change, so searches begun on older ones are not cached
+        self._index_generation = 0
+        # Serializes additions to the document list and index rebuilds
+        self._index_lock = threading.Lock()
+        self._reset_query_cache()
         
-    def create_vector_store(self):
-        """Create vector store from metadata"""
-        if not self.metadata_store:
-            raise ValueError("No metadata available to create vector store")
-            
-        # Create documents with rich content for better matching
-        self.docs = []
-        for entry in self.metadata_store:
-            # Create comprehensive content that includes all searchable information
-            content_parts = [
-                f"Setting: {entry.get('landscape_description', '')}",
-                f"Mood: {entry.get('mood', '')}",
-                f"Weather: {entry.get('weather', '')}",
-                f"People count: {entry.get('number_of_people', 0)}",
-                f"Hand signs: {entry.get('sign_used', 'none')}"
-            ]
-            
-            # Add descriptive terms based on metadata
-            descriptive_terms = []
-            
-            # Add people-related terms
-            people_count = entry.get('number_of_people', 0)
-            if people_count == 0:
-                descriptive_terms.append("no people")
-            elif people_count == 1:
-                descriptive_terms.append("single person")
-            elif people_count > 1:
-                descriptive_terms.append("multiple people")
-                descriptive_terms.append("group")
-            
-            # Add sign-related terms
-            sign_used = entry.get('sign_used', '').lower()
-            if 'thumbs' in sign_used:
-                descriptive_terms.extend(['thumbs up', 'positive gesture', 'approval'])
-            elif 'peace' in sign_used or 'v-sign' in sign_used:
-                descriptive_terms.extend(['peace sign', 'v sign', 'victory'])
-            elif sign_used != 'none' and sign_used:
-                descriptive_terms.append('hand gesture')
-            
-            # Add weather-related terms
-            weather = entry.get('weather', '').lower()
-            if weather in ['sunny', 'clear', 'bright']:
-                descriptive_terms.extend(['sunny', 'bright', 'good weather', 'clear sky'])
-            elif weather in ['cloudy', 'overcast']:
-                descriptive_terms.extend(['cloudy', 'overcast', 'gray sky'])
-            
-            # Add setting-related terms
-            landscape = entry.get('landscape_description', '').lower()
-            if 'outdoor' in landscape or 'outside' in landscape:
-                descriptive_terms.extend(['outdoor', 'outside', 'nature'])
-            elif 'indoor' in landscape or 'inside' in landscape:
-                descriptive_terms.extend(['indoor', 'inside'])
-            
-            if 'beach' in landscape:
-                descriptive_terms.extend(['beach', 'sand', 'ocean', 'seaside'])
-            elif 'mountain' in landscape:
-                descriptive_terms.extend(['mountain', 'hills', 'elevation'])
-            elif 'city' in landscape:
-                descriptive_terms.extend(['city', 'urban', 'buildings'])
-            
-            # Combine all content
-            full_content = ' '.join(content_parts + descriptive_terms)
-            
-            doc = Document(
-                page_content=full_content,
-                metadata={
-                    "sign_used": entry.get("sign_used", "none"),
-                    "number_of_people": entry.get("number_of_people", 0),
-                    "landscape_description": entry.get("landscape_description", ""),
-                    "weather": entry.get("weather", "unknown"),
-                    "mood": entry.get("mood", "neutral"),
-                    "image_name": entry.get("image_name", "")
-                }
-            )
-            self.docs.append(doc)
+    def _build_document(self, entry: Dict[str, Any]) -> Document:
+        """Create a document with rich content for better matching"""
+        # Create comprehensive content that includes all searchable information
+        content_parts = [
+            f"Setting: {entry.get('landscape_description', '')}",
+            f"Mood: {entry.get('mood', '')}",
+            f"Weather: {entry.get('weather', '')}",
+            f"People count: {entry.get('number_of_people', 0)}",
+            f"Hand signs: {entry.get('sign_used', 'none')}"
+        ]
+        
+        # Add descriptive terms based on metadata
+        descriptive_terms = []
+        
+        # Add people-related terms
+        people_count = entry.get('number_of_people', 0)
+        if people_count == 0:
+            descriptive_terms.append("no people")
+        elif people_count == 1:
+            descriptive_terms.append("single person")
+        elif people_count > 1:
+            descriptive_terms.append("multiple people")
+            descriptive_terms.append("group")
+        
+        # Add sign-related terms
+        sign_used = entry.get('sign_used', '').lower()
+        if 'thumbs' in sign_used:
+            descriptive_terms.extend(['thumbs up', 'positive gesture', 'approval'])
+        elif 'peace' in sign_used or 'v-sign' in sign_used:
+            descriptive_terms.extend(['peace sign', 'v sign', 'victory'])
+        elif sign_used != 'none' and sign_used:
+            descriptive_terms.append('hand gesture')
+        
+        # Add weather-related terms
+        weather = entry.get('weather', '').lower()
+        if weather in ['sunny', 'clear', 'bright']:
+            descriptive_terms.extend(['sunny', 'bright', 'good weather', 'clear sky'])
+        elif weather in ['cloudy', 'overcast']:
+            descriptive_terms.extend(['cloudy', 'overcast', 'gray sky'])
+        
+        # Add setting-related terms
+        landscape = entry.get('landscape_description', '').lower()
+        if 'outdoor' in landscape or 'outside' in landscape:
+            descriptive_terms.extend(['outdoor', 'outside', 'nature'])
+        elif 'indoor' in landscape or 'inside' in landscape:
+            descriptive_terms.extend(['indoor', 'inside'])
         
+        if 'beach' in landscape:
+            descriptive_terms.extend(['beach', 'sand', 'ocean', 'seaside'])
+        elif 'mountain' in landscape:
+            descriptive_terms.extend(['mountain', 'hills', 'elevation'])
+        elif 'city' in landscape:
+            descriptive_terms.extend(['city', 'urban', 'buildings'])
+        
+        # Combine all content
+        full_content = ' '.join(content_parts + descriptive_terms)
+        
+        doc = Document(
+            page_content=full_content,
+            metadata={
+                "sign_used": entry.get("sign_used", "none"),
+                "number_of_people": entry.get("number_of_people", 0),
+                "landscape_description": entry.get("landscape_description", ""),
+                "weather": entry.get("weather", "unknown"),
+                "mood": entry.get("mood", "neutral"),
+                "image_name": entry.get("image_name", "")
+            }
+        )
+        return doc
+    
+    def create_vector_store(self):
+        """Open the persistent vector store and index any pending metadata"""
         try:
             # Try Google embeddings first
-            embeddings = GoogleGenerativeAIEmbeddings(
+            self.embeddings = GoogleGenerativeAIEmbeddings(
                 model="models/embedding-001",
                 google_api_key=os.getenv("GEMINI_API_KEY")
             )
-            self.vectorstore = Chroma.from_documents(self.docs, embeddings)
-            print("Vector store created successfully with Google embeddings")
+            client = _chroma_client()
+            self.vectorstore = Chroma(
+                client=client,
+                collection_name=COLLECTION_NAME,
+                embedding_function=self.embeddings
+            )
+            # Pick up documents indexed by earlier runs
+            self.refresh()
+            print(f"Vector store ready with Google embeddings ({len(self.docs)} stored documents)")
         except Exception as e:
             print(f"Google embeddings failed: {e}")
             # Continue with simple search fallback
             self.vectorstore = None
         
+        self._index_entries(self.metadata_store)
         return self.vectorstore
     
+    def add_metadata(self, new_metadata: List[Dict[str, Any]]) -> int:
+        """Index newly processed images, embedding only the new documents"""
+        self.metadata_store.extend(new_metadata)
+        return self._index_entries(new_metadata)
+    
+    def refresh(self):
+        """Pick up documents stored by earlier runs or other API workers sharing a Chroma server"""
+        if not self.vectorstore or self.vectorstore._collection.count() == len(self.doc_ids):
+            return
+        
+        with self._index_lock:
+            stored = self.vectorstore._collection.get(include=["documents", "metadatas"])
+            known_ids = set(self.doc_ids)
+            new_docs, new_ids = [], []
+            for doc_id, content, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+                if doc_id not in known_ids:
+                    new_docs.append(Document(page_content=content, metadata=metadata))
+                    new_ids.append(doc_id)
+            
+            if new_docs:
+                self._append_documents(new_docs, new_ids)
+                print(f"Loaded {len(new_docs)} documents from the persistent store")
+    
+    def _index_entries(self, entries: List[Dict[str, Any]]) -> int:
+        """Append documents for metadata entries not indexed yet and refresh the search indexes"""
+        with self._index_lock:
+            known_ids = set(self.doc_ids)
+            new_docs, new_ids = [], []
+            for entry in entries:
+                doc = self._build_document(entry)
+                # Image-addressed ids make true re-uploads hit the stored embeddings
+                doc_id = _document_id(doc)
+                if doc_id not in known_ids:
+                    known_ids.add(doc_id)
+                    new_docs.append(doc)
+                    new_ids.append(doc_id)
+            
+            if new_docs and self.vectorstore:
+                try:
+                    new_count = self._add_new_documents(new_docs, new_ids)
+                except Exception as e:
+                    # Leave the store and local view untouched so a retry can index these images
+                    print(f"Failed to embed new documents: {e}")
+                    raise
+                print(f"Embedded {new_count} new documents ({len(new_docs) - new_count} already stored)")
+            
+            if new_docs:
+                self._append_documents(new_docs, new_ids)
+            return len(new_docs)
+    
+    def _append_documents(self, new_docs: List[Document], new_ids: List[str]):
+        """Add documents to the local view and refresh the search indexes (caller holds _index_lock)"""
+        # Documents are append-only and the lists are replaced rather than mutated,
+        # so searches running meanwhile still see indexes built over a prefix of docs
+        self.docs = self.docs + new_docs
+        self.doc_ids = self.doc_ids + new_ids
+        self._lc = self._lc + [doc.page_content.lower() for doc in new_docs]
+        self._lc_meta = self._lc_meta + [_lowercase_metadata(doc.metadata) for doc in new_docs]
+        self._rebuild_indexes()
+    
+    def _rebuild_indexes(self):
+        """Refit the local TF-IDF and FAISS indexes over all documents"""
+        if self.docs:
+            self._fit_indexes()
+        
+        # Only after the new indexes are published, so a search that sees the new
+        # generation also searched them
+        with self._qcache_lock:
+            self._index_generation += 1
+            self._reset_query_cache()
+    
+    def _fit_indexes(self):
+        """Build the TF-IDF and FAISS indexes and publish them"""
+        # Fit TF-IDF once per change so the text search fallback is a sparse matmul per query
+        # Content is already lowercased, so the vectorizer can skip that pass
+        vectorizer = TfidfVectorizer(lowercase=False, ngram_range=(1, 2))
+        doc_tfidf = vectorizer.fit_transform(self._lc)
+        self._tfidf = (vectorizer, doc_tfidf)
+        
+        faiss_index = None
+        if self.vectorstore and len(self.docs) < FAISS_MAX_DOCS:
+            try:
+                faiss_index = self._build_faiss_index()
+            except Exception as e:
+                print(f"FAISS index build failed, using Chroma search: {e}")
+        self.faiss_index = faiss_index
+    
+    def _build_faiss_index(self):
+        """Index the stored document embeddings (int8-quantized) for inner-product search"""
+        # Reuse the embeddings Chroma already holds instead of re-embedding
+        stored = self.vectorstore._collection.get(ids=list(set(self.doc_ids)), include=["embeddings"])
+        embeddings_by_id = dict(zip(stored["ids"], stored["embeddings"]))
+        
+        emb_matrix = np.array([embeddings_by_id[doc_id] for doc_id in self.doc_ids], dtype='float32')
+        faiss.normalize_L2(emb_matrix)
+        # 8-bit scalar quantization: a quarter of the memory of float32 vectors
+        faiss_index = faiss.IndexScalarQuantizer(
+            emb_matrix.shape[1],
+            faiss.ScalarQuantizer.QT_8bit,
+            faiss.METRIC_INNER_PRODUCT
+        )
+        faiss_index.train(emb_matrix)
+        faiss_index.add(emb_matrix)
+        return faiss_index
+    
+    def _add_new_documents(self, docs: List[Document], ids: List[str]) -> int:
+        """Embed and store only documents not already in the persistent collection"""
+        existing = set(self.vectorstore._collection.get(ids=ids)['ids'])
+        
+        new_docs, new_ids = [], []
+        for doc, doc_id in zip(docs, ids):
+            if doc_id not in existing:
+                existing.add(doc_id)
+                new_docs.append(doc)
+                new_ids.append(doc_id)
+        
+        if new_docs:
+            self.vectorstore.add_documents(new_docs, ids=new_ids)
+        return len(new_docs)
+    
+    def _reset_query_cache(self):
+        """Drop cached query results, e.g. after the indexed documents change"""
+        self.qcache_index = faiss.IndexFlatIP(EMBEDDING_DIM)
+        self.qcache_payloads = []
+    
+    def _lookup_query_cache(self, query_vec: np.ndarray, limit: int) -> List[Dict[str, Any]]:
+        """Return cached results for a near-duplicate past query, if any"""
+        with self._qcache_lock:
+            if self.qcache_index.ntotal == 0:
+                return None
+            
+            D, I = self.qcache_index.search(query_vec, 1)
+            if D[0, 0] >= QUERY_CACHE_THRESHOLD:
+                cached_limit, results = self.qcache_payloads[I[0, 0]]
+                if cached_limit == limit:
+                    return results
+            return None
+    
+    def _store_query_cache(self, query_vec: np.ndarray, limit: int, results: List[Dict[str, Any]], generation: int):
+        """Remember results for a query embedding, unless the indexes changed since the search began"""
+        with self._qcache_lock:
+            if generation != self._index_generation:
+                return
+            if self.qcache_index.ntotal >= QUERY_CACHE_SIZE:
+                self._reset_query_cache()
+            self.qcache_index.add(query_vec)
+            self.qcache_payloads.append((limit, results))
+    
+    def _embed_query_uncached(self, query: str) -> tuple:
+        """Embed a normalized query string (wrapped by the LRU in __init__)"""
+        return tuple(self.embeddings.embed_query(query))
+    
     def simple_search(self, query: str, limit: int = 3) -> List[Dict[str, Any]]:
         """Enhanced search with better text matching"""
         if not self.docs:
-            self.create_vector_store()
+            return []
         
+        generation = self._index_generation
         results = []
+        cache_vec = None
         
         if self.vectorstore:
             try:
+                query_vec = self._embed_query(query.lower().strip())
+                
+                # Serve near-duplicate queries straight from the semantic cache
+                cache_vec = np.array(query_vec, dtype='float32')[None]
+                faiss.normalize_L2(cache_vec)
+                cached = self._lookup_query_cache(cache_vec, limit)
+                if cached is not None:
+                    return cached
+                
                 # Use vector search if available
-                docs = self.vectorstore.similarity_search(query, k=limit)
+                faiss_index = self.faiss_index
+                if faiss_index is not None:
+                    # Small collections: flat scan over the quantized in-memory index
+                    _, I = faiss_index.search(cache_vec, min(limit, faiss_index.ntotal))
+                    docs = [self.docs[idx] for idx in I[0] if idx >= 0]
+                else:
+                    docs = self.vectorstore.similarity_search_by_vector(list(query_vec), k=limit)
                 results = [
                     {
                         "image_url": f"/public/{doc.metadata['image_name']}",
@@ -341,81 +614,82 @@ class ImageRetriever:
         if not results:
             results = self._enhanced_text_search(query, limit)
         
+        if cache_vec is not None:
+            self._store_query_cache(cache_vec, limit, results, generation)
+        
         return results
     
     def _enhanced_text_search(self, query: str, limit: int) -> List[Dict[str, Any]]:
         """Enhanced text matching with keyword expansion"""
         query_lower = query.lower()
-        scored_docs = []
         
         # Expand query with synonyms
         expanded_terms = self._expand_query_terms(query_lower)
         
-        for doc in self.docs:
-            content = doc.page_content.lower()
-            metadata = doc.metadata
-            score = 0
-            
-            # Score based on exact matches
-            for term in expanded_terms:
-                if term in content:
-                    score += content.count(term) * 2
-            
-            # Score based on metadata matching
-            if 'thumbs' in query_lower and 'thumbs' in metadata.get('sign_used', '').lower():
-                score += 10
-            if 'peace' in query_lower and 'peace' in metadata.get('sign_used', '').lower():
-                score += 10
-            if 'people' in query_lower:
-                people_count = metadata.get('number_of_people', 0)
-                if people_count > 0:
-                    score += people_count * 3
-            if 'outdoor' in query_lower and 'outdoor' in metadata.get('landscape_description', '').lower():
-                score += 5
-            if 'indoor' in query_lower and 'indoor' in metadata.get('landscape_description', '').lower():
-                score += 5
-            if 'sunny' in query_lower and 'sunny' in metadata.get('weather', '').lower():
-                score += 5
-            
-            if score > 0:
-                scored_docs.append((doc, score))
+        tfidf = self._tfidf
+        if tfidf is None:
+            return []
+        vectorizer, doc_tfidf = tfidf
+        # The TF-IDF rows cover a prefix of the append-only document list
+        docs = self.docs[:doc_tfidf.shape[0]]
+        lc_meta = self._lc_meta[:doc_tfidf.shape[0]]
         
-        # Sort by score and take top results
-        scored_docs.sort(key=lambda x: x[1], reverse=True)
+        # Score every document at once with a sparse TF-IDF dot product
+        query_vec = vectorizer.transform([' '.join(expanded_terms)])
+        scores = (doc_tfidf @ query_vec.T).toarray().ravel()
+        scores += self._metadata_boosts(query_lower, lc_meta)
+        
+        # Take the top results among documents that matched at all
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit)[:limit]]
+        top = candidates[np.argsort(-scores[candidates], kind='stable')]
         
         results = []
-        for doc, score in scored_docs[:limit]:
+        for idx in top:
+            doc = docs[idx]
             results.append({
                 "image_url": f"/public/{doc.metadata['image_name']}",
                 "metadata": doc.metadata,
                 "content": doc.page_content,
-                "score": score  # Include score for debugging
+                "score": float(scores[idx])  # Include score for debugging
             })
         
         return results
     
+    def _metadata_boosts(self, query_lower: str, lc_meta: List[Dict[str, Any]]) -> np.ndarray:
+        """Per-document score boosts for query terms matching structured metadata"""
+        # Kept small relative to TF-IDF cosine scores, which lie in [0, 1]
+        boosts = np.zeros(len(lc_meta))
+        for idx, metadata in enumerate(lc_meta):
+            if 'thumbs' in query_lower and 'thumbs' in metadata.get('sign_used', ''):
+                boosts[idx] += 1.0
+            if 'peace' in query_lower and 'peace' in metadata.get('sign_used', ''):
+                boosts[idx] += 1.0
+            if 'people' in query_lower:
+                people_count = metadata.get('number_of_people', 0)
+                if people_count > 0:
+                    boosts[idx] += people_count * 0.3
+            if 'outdoor' in query_lower and 'outdoor' in metadata.get('landscape_description', ''):
+                boosts[idx] += 0.5
+            if 'indoor' in query_lower and 'indoor' in metadata.get('landscape_description', ''):
+                boosts[idx] += 0.5
+            if 'sunny' in query_lower and 'sunny' in metadata.get('weather', ''):
+                boosts[idx] += 0.5
+        
+        return boosts
+    
     def _expand_query_terms(self, query: str) -> List[str]:
         """Expand query terms with synonyms for better matching"""
         terms = query.split()
-        expanded = set(terms)  # Start with original terms
+        expanded = list(terms)  # Start with original terms
         
         # Add synonyms
-        synonyms = {
-            'thumbs': ['thumbs up', 'thumb', 'approval', 'positive'],
-            'peace': ['peace sign', 'v sign', 'victory', 'v-sign'],
-            'people': ['person', 'individuals', 'humans', 'group'],
-            'outdoor': ['outside', 'nature', 'exterior'],
-            'indoor': ['inside', 'interior'],
-            'sunny': ['bright', 'clear', 'sunshine'],
-            'happy': ['joyful', 'cheerful', 'positive'],
-            'group': ['multiple', 'several', 'many']
-        }
-        
         for term in terms:
-            if term in synonyms:
-                expanded.update(synonyms[term])
+            if term in SYNONYMS:
+                expanded.extend(SYNONYMS[term])
         
-        return list(expanded)
+        return expanded
     
     def retrieve_images(self, query: str, limit: int = 3) -> List[Document]:
         """Backward compatibility method"""
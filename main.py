@@ -1,8 +1,12 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, Dict, Any, Literal, Optional
+from contextlib import asynccontextmanager
+import asyncio
+import orjson
 import os
 from image_process import ImageMetadataProcessor, ImageRetriever
 from dotenv import load_dotenv
@@ -10,7 +14,25 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()  
 
-app = FastAPI()
+# Total in-flight Gemini requests across all API workers
+GEMINI_CONCURRENCY = 8
+
+# Created per serving process in lifespan, not at import time
+processor = None
+retriever = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global processor, retriever
+    # Gemini rate limits apply per API key, so split the cap between workers
+    workers = int(os.getenv("API_WORKERS", "1"))
+    processor = ImageMetadataProcessor(max_concurrency=max(1, GEMINI_CONCURRENCY // workers))
+    # Single long-lived retriever backed by the persistent Chroma store
+    retriever = ImageRetriever()
+    await asyncio.to_thread(retriever.create_vector_store)
+    yield
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Allow CORS for Streamlit frontend
 app.add_middleware(
@@ -24,83 +46,199 @@ app.add_middleware(
 os.makedirs("public", exist_ok=True)
 app.mount("/public", StaticFiles(directory="public"), name="public")
 
-class ProcessRequest(BaseModel):
-    image_paths: List[str]
-
 class QueryRequest(BaseModel):
     query: str
 
-# Global variables
-processor = ImageMetadataProcessor()
-retriever = None
+class BatchItem(BaseModel):
+    url: Literal["/status/", "/query_images/"]
+    payload: Optional[QueryRequest] = Field(None, alias="json")
+
+class BatchRequest(BaseModel):
+    # Each query item costs an embedding call, so keep batches small
+    requests: List[BatchItem] = Field(..., max_length=16)
+
+class ImageMeta(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+    
+    sign_used: str
+    number_of_people: int
+    landscape_description: str
+    weather: str
+    mood: str
+    image_name: str
+
+class ProcessResponse(BaseModel):
+    message: str
+    processed_count: int
+    metadata: List[ImageMeta]
+
+class QueryResult(BaseModel):
+    image_url: str
+    metadata: ImageMeta
+    content: str
+    score: Optional[float] = None
+
+class QueryResponse(BaseModel):
+    query: str
+    results: List[QueryResult]
 
 @app.get("/")
 async def root():
     return {"message": "Image Processing API is running"}
 
-@app.post("/process_images/")
-async def process_images(request: ProcessRequest):
-    global retriever
+# Uploads are served back from public/, so only plain raster images are accepted
+ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+ALLOWED_CONTENT_TYPES = {"image/jpeg", "image/png", "image/webp"}
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+
+async def read_upload(upload: UploadFile) -> bytes:
+    """Read one upload after checking its type and size"""
+    ext = os.path.splitext(upload.filename or "")[1].lower()
+    if ext not in ALLOWED_EXTENSIONS or upload.content_type not in ALLOWED_CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {upload.filename}")
     
+    data = await upload.read(MAX_UPLOAD_BYTES + 1)
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"File too large: {upload.filename}")
+    return data
+
+def remove_uploads(paths: List[str]):
+    """Delete saved uploads that did not end up indexed"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"Could not remove {path}: {e}")
+
+@app.post("/process_images/", response_model=ProcessResponse)
+async def process_images(files: List[UploadFile] = File(...)):
+    public_paths = []
+    indexed = set()
     try:
-        # Validate image paths
-        valid_paths = []
-        for path in request.image_paths:
-            if os.path.exists(path):
-                valid_paths.append(path)
-            else:
-                print(f"Warning: Image path does not exist: {path}")
+        if not files:
+            raise HTTPException(status_code=400, detail="No images uploaded")
         
-        if not valid_paths:
-            raise HTTPException(status_code=400, detail="No valid image paths provided")
+        # Validate every upload before anything is written to the public folder
+        uploads = [(upload.filename, await read_upload(upload)) for upload in files]
         
-        # Process images and create retriever
-        metadata_store = processor.process_images(valid_paths)
+        # Write each upload straight into the public folder, once
+        saved = await asyncio.gather(
+            *(processor.save_upload(name, data) for name, data in uploads),
+            return_exceptions=True
+        )
+        # Keep track of the writes that succeeded so a failed one still cleans them up
+        public_paths = [path for path in saved if isinstance(path, str)]
+        errors = [e for e in saved if isinstance(e, BaseException)]
+        if errors:
+            raise errors[0]
+        
+        # Process images
+        metadata_store = await processor.process_images(public_paths)
         if not metadata_store:
             raise HTTPException(status_code=400, detail="No metadata could be processed from images")
         
-        # Create retriever with processed metadata
-        retriever = ImageRetriever(metadata_store)
-        retriever.create_vector_store()  # Initialize the vector store
+        # Index only the new images; earlier ones keep their stored embeddings
+        await asyncio.to_thread(retriever.add_metadata, metadata_store)
+        indexed = {entry["image_name"] for entry in metadata_store}
         
-        return {
-            "message": "Images processed successfully",
-            "processed_count": len(metadata_store),
-            "metadata": metadata_store
-        }
+        return ProcessResponse(
+            message="Images processed successfully",
+            processed_count=len(metadata_store),
+            metadata=metadata_store
+        )
     
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in process_images: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    finally:
+        # Images without metadata, or from a failed index, would otherwise linger in public/
+        remove_uploads([path for path in public_paths if os.path.basename(path) not in indexed])
+
+async def run_query(query: str) -> List[Dict[str, Any]]:
+    """Run a search off the event loop"""
+    return await asyncio.to_thread(retriever.simple_search, query, 5)
 
 @app.post("/query_images/")
 async def query_images(request: QueryRequest):
-    global retriever
+    # Other workers may have indexed images since this worker last looked
+    await asyncio.to_thread(retriever.refresh)
+    if not retriever.docs:
+        raise HTTPException(status_code=400, detail="Process images first using /process_images/ endpoint")
     
-    try:
-        if not retriever:
-            raise HTTPException(status_code=400, detail="Process images first using /process_images/ endpoint")
-        
-        # Use the simple_search method which returns properly formatted results
-        results = retriever.simple_search(request.query, limit=5)
-        
-        return {
-            "query": request.query,
-            "results": results
-        }
+    async def event_stream():
+        try:
+            # Stream each match as an SSE event
+            results = await run_query(request.query)
+            for result in results:
+                # Serialize through the fixed schema with pydantic's compiled encoder
+                event = QueryResult.model_validate(result).model_dump_json(exclude_none=True)
+                yield b"data: " + event.encode() + b"\n\n"
+        except Exception as e:
+            print(f"Error in query_images: {e}")
+            yield b"event: error\ndata: " + orjson.dumps({"detail": f"Internal server error: {str(e)}"}) + b"\n\n"
     
-    except Exception as e:
-        print(f"Error in query_images: {e}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 @app.get("/status/")
 async def get_status():
+    await asyncio.to_thread(retriever.refresh)
     return {
         "processor_initialized": processor is not None,
-        "retriever_initialized": retriever is not None,
+        "retriever_initialized": bool(retriever.docs),
+        "indexed_count": len(retriever.docs),
         "metadata_count": len(processor.metadata_store) if processor else 0
     }
 
+async def dispatch_batch_item(item: BatchItem) -> Dict[str, Any]:
+    """Run one batched sub-request against the matching local handler"""
+    url = item.url
+    
+    try:
+        if url == "/status/":
+            body = await get_status()
+        else:
+            if item.payload is None:
+                raise HTTPException(status_code=422, detail="/query_images/ requires a json body with a query")
+            await asyncio.to_thread(retriever.refresh)
+            if not retriever.docs:
+                raise HTTPException(status_code=400, detail="Process images first using /process_images/ endpoint")
+            query = item.payload.query
+            # Same shape as the /query_images/ events: unset scores are omitted
+            body = QueryResponse(query=query, results=await run_query(query)).model_dump(exclude_none=True)
+        
+        return {"url": url, "status_code": 200, "body": body}
+    
+    except HTTPException as e:
+        return {"url": url, "status_code": e.status_code, "body": {"detail": e.detail}}
+    except Exception as e:
+        print(f"Error in batch item {url}: {e}")
+        return {"url": url, "status_code": 500, "body": {"detail": f"Internal server error: {str(e)}"}}
+
+@app.post("/batch/")
+async def batch(request: BatchRequest):
+    # Fold several independent calls into one round-trip
+    responses = await asyncio.gather(*(dispatch_batch_item(item) for item in request.requests))
+    return {"responses": responses}
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    workers = int(os.getenv("API_WORKERS", "1"))
+    if workers > 1 and not os.getenv("CHROMA_HOST"):
+        # The on-disk Chroma client is not process-safe; workers must share a Chroma server
+        print("API_WORKERS > 1 requires CHROMA_HOST (a shared Chroma server); starting a single worker")
+        workers = 1
+    # Inherited by the worker processes for the Gemini concurrency split
+    os.environ["API_WORKERS"] = str(workers)
+    
+    uvicorn.run(
+        # Worker processes import the app themselves; a single worker serves this one
+        "main:app" if workers > 1 else app,
+        host="0.0.0.0",
+        port=8000,
+        workers=workers,
+        # uvloop/httptools when installed (uvloop is not available on Windows)
+        loop="auto",
+        http="auto"
+    )
\ No newline at end of file